@@ -0,0 +1,46 @@
+"""
+ASGI Application Entry Point
+
+Wraps the Flask (WSGI) application so it can be served by an ASGI server.
+Each request runs on its own thread from a per-process pool, so a slow chat
+request (scrape plus OpenAI call) or an open /message/stream response does
+not hold up other requests in the same worker.
+
+Usage:
+    uvicorn asgi:app --workers $(nproc) --loop uvloop --http httptools
+
+Alternatively, serve the WSGI app directly with threaded Gunicorn workers:
+    gunicorn -k gthread -w $(nproc) --threads 64 -b 0.0.0.0:5000 'backend.app:create_app()'
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from backend.app import create_app
+
+# Requests run concurrently per worker process (each open SSE stream holds one)
+WSGI_THREADS = 64
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='wsgi')
+
+
+class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    # asgiref wraps run_wsgi_app with thread_sensitive=True, which puts every
+    # request in the process on one shared thread; rewrap the plain function
+    run_wsgi_app = sync_to_async(
+        WsgiToAsgiInstance.__dict__['run_wsgi_app'].func,
+        thread_sensitive=False,
+        executor=_EXECUTOR
+    )
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    """WsgiToAsgi that runs requests concurrently on a thread pool"""
+
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiToAsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+app = ThreadedWsgiToAsgi(create_app())
@@ -1,6 +1,8 @@
 from flask import Flask
 from flask_cors import CORS
+from flask_orjson import OrjsonProvider
 from dotenv import load_dotenv
+import orjson
 import os
 
 
@@ -17,6 +19,11 @@ def create_app():
     # Create Flask app
     app = Flask(__name__)
     
+    # Serialize JSON responses with orjson instead of the stdlib json module.
+    # Naive datetimes are emitted as-is (same output as .isoformat()).
+    app.json = OrjsonProvider(app)
+    app.json.option = orjson.OPT_SERIALIZE_DATACLASS
+    
     # Configuration
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
     app.config['DATABASE'] = os.getenv('DATABASE_PATH', 'database.db')
@@ -24,6 +31,16 @@ def create_app():
     # Enable CORS for all routes
     CORS(app)
     
+    # Shared OpenAI helper (one HTTP connection pool for the whole app)
+    from backend.utils.openai_helper import OpenAIHelper
+    openai_helper = OpenAIHelper()
+    app.extensions['openai_helper'] = openai_helper
+    
+    # Open the API connection in the background so the first chat request
+    # doesn't pay for DNS, TLS and HTTP/2 setup (repeated in each worker
+    # forked from this process)
+    openai_helper.start_warm_up()
+    
     # Register blueprints
     from backend.routes.auth import auth_bp
     from backend.routes.chat import chat_bp
@@ -32,7 +49,8 @@ def create_app():
     app.register_blueprint(chat_bp, url_prefix='/api/chat')
     
     # Initialize database on app startup
-    from backend.utils.db import init_db
+    from backend.utils.db import init_db, close_db
+    app.teardown_appcontext(close_db)
     with app.app_context():
         init_db()
         print("Database initialized successfully")
@@ -2,7 +2,7 @@ from dataclasses import dataclass
 from datetime import datetime
 from typing import List, Optional
 
-@dataclass
+@dataclass(slots=True)
 class Message:
     id: int
     chat_id: str
@@ -16,10 +16,10 @@ class Message:
             'chat_id': self.chat_id,
             'role': self.role,
             'content': self.content,
-            'timestamp': self.timestamp.isoformat()
+            'timestamp': self.timestamp
         }
 
-@dataclass
+@dataclass(slots=True)
 class Chat:
     id: str
     user_id: int
@@ -31,8 +31,8 @@ class Chat:
         result = {
             'id': self.id,
             'user_id': self.user_id,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
         }
         
         if self.messages:
@@ -15,7 +15,7 @@ class User:
             'id': self.id,
             'email': self.email,
             'username': self.username,
-            'created_at': self.created_at.isoformat()
+            'created_at': self.created_at
         }
     
     @staticmethod
@@ -1,23 +1,121 @@
 from flask import Blueprint, request, jsonify
 from functools import wraps
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from cachetools import TTLCache
+from typing import Optional
+from argon2 import PasswordHasher, exceptions as argon2_exc
 import bcrypt
+import hashlib
 import jwt
+import multiprocessing
 import os
 import re
-from datetime import datetime, timedelta
-from backend.utils.db import create_user, get_user_by_email, get_user_by_id
+import threading
+import time
+from backend.utils.db import create_user, get_user_by_email, get_user_by_id, update_user_password_hash
 
 auth_bp = Blueprint('auth', __name__)
 
 # Get secret key from environment
 SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
 
+# Shared JWT encoder/decoder instance
+_JWT = jwt.PyJWT()
+
+# Token lifetime in seconds (24 hours)
+TOKEN_TTL_SECONDS = 24 * 60 * 60
+
+# Cache of recently verified token payloads, keyed by a hash of the token
+# (raw tokens are never stored). Expiry is still checked on every hit.
+_TOKEN_CACHE = TTLCache(maxsize=10000, ttl=30)
+_TOKEN_CACHE_LOCK = threading.RLock()
+
+# Argon2id with the OWASP-recommended profile (46 MiB, 1 pass, 1 lane).
+# argon2-cffi releases the GIL while hashing. Raise these over time.
+_PH = PasswordHasher(time_cost=1, memory_cost=46 * 1024, parallelism=1)
+
+# Hashes created before the Argon2 migration are bcrypt ($2a$/$2b$/$2y$).
+# Checking them is CPU-bound, so it runs in worker processes to keep request
+# threads free. The pool is created per process on first use (see
+# _get_bcrypt_pool()). Its workers are spawned as fresh interpreters rather
+# than forked from a process that is already running threads (forkserver
+# keeps a module-global server that forked web workers would inherit).
+_BCRYPT_PREFIX = '$2'
+_BCRYPT_MP_CONTEXT = multiprocessing.get_context('spawn')
+_bcrypt_pool: Optional[ProcessPoolExecutor] = None
+_bcrypt_pool_pid: Optional[int] = None
+_bcrypt_pool_lock = threading.Lock()
+
+# Email format pattern, compiled once. \Z (unlike $) rejects a trailing newline.
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}\Z')
+
 
 # Password hashing functions
 
+def _bcrypt_check_worker(password: bytes, hashed: bytes) -> bool:
+    """Check a password against a bcrypt hash (runs in a bcrypt pool worker)"""
+    return bcrypt.checkpw(password, hashed)
+
+
+def _reset_bcrypt_pool_after_fork() -> None:
+    """Forget the parent's pool and lock in a forked child"""
+    global _bcrypt_pool, _bcrypt_pool_pid, _bcrypt_pool_lock
+    _bcrypt_pool = None
+    _bcrypt_pool_pid = None
+    _bcrypt_pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_bcrypt_pool_after_fork)
+
+
+def _get_bcrypt_pool() -> ProcessPoolExecutor:
+    """
+    Return this process's bcrypt worker pool, creating it on first use
+    
+    A pool inherited across fork (e.g. gunicorn --preload) shares its call
+    and result pipes with the parent and sibling workers, so each process
+    must build its own.
+    """
+    global _bcrypt_pool, _bcrypt_pool_pid
+    with _bcrypt_pool_lock:
+        if _bcrypt_pool is None or _bcrypt_pool_pid != os.getpid():
+            _bcrypt_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count(), mp_context=_BCRYPT_MP_CONTEXT
+            )
+            _bcrypt_pool_pid = os.getpid()
+        return _bcrypt_pool
+
+
+def _discard_bcrypt_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken bcrypt pool so the next _get_bcrypt_pool() builds a new one"""
+    global _bcrypt_pool, _bcrypt_pool_pid
+    with _bcrypt_pool_lock:
+        # Another thread may already have replaced it
+        if _bcrypt_pool is pool:
+            _bcrypt_pool = None
+            _bcrypt_pool_pid = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _bcrypt_check(password: bytes, hashed: bytes) -> bool:
+    """
+    Check a bcrypt hash in the worker pool
+    
+    If a worker died (OOM kill, crash) the pool is broken for good, so it is
+    replaced and the check retried once on the fresh pool.
+    """
+    pool = _get_bcrypt_pool()
+    try:
+        return pool.submit(_bcrypt_check_worker, password, hashed).result()
+    except BrokenProcessPool:
+        _discard_bcrypt_pool(pool)
+    return _get_bcrypt_pool().submit(_bcrypt_check_worker, password, hashed).result()
+
+
 def hash_password(password: str) -> str:
     """
-    Hash a password using bcrypt
+    Hash a password using Argon2id
     
     Args:
         password: Plain text password
@@ -25,16 +123,15 @@ def hash_password(password: str) -> str:
     Returns:
         Hashed password as string
     """
-    # Generate salt and hash password
-    salt = bcrypt.gensalt(rounds=12)
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
+    return _PH.hash(password)
 
 
 def verify_password(password: str, hashed: str) -> bool:
     """
     Verify a password against a hash
     
+    Accepts both Argon2id hashes and legacy bcrypt hashes.
+    
     Args:
         password: Plain text password to verify
         hashed: Hashed password to compare against
@@ -42,7 +139,29 @@ def verify_password(password: str, hashed: str) -> bool:
     Returns:
         True if password matches, False otherwise
     """
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    if hashed.startswith(_BCRYPT_PREFIX):
+        # bcrypt hashes are pure ASCII, which takes the cheaper ascii codec path
+        return _bcrypt_check(password.encode('utf-8'), hashed.encode('ascii'))
+    
+    try:
+        return _PH.verify(hashed, password)
+    except (argon2_exc.VerificationError, argon2_exc.InvalidHashError):
+        return False
+
+
+def password_needs_rehash(hashed: str) -> bool:
+    """
+    Check whether a stored hash should be replaced on next successful login
+    
+    Args:
+        hashed: Stored password hash
+        
+    Returns:
+        True for legacy bcrypt hashes and Argon2 hashes with outdated parameters
+    """
+    if hashed.startswith(_BCRYPT_PREFIX):
+        return True
+    return _PH.check_needs_rehash(hashed)
 
 
 # JWT token functions
@@ -57,13 +176,14 @@ def generate_token(user_id: int) -> str:
     Returns:
         JWT token as string
     """
+    now = int(time.time())
     payload = {
         'user_id': user_id,
-        'exp': datetime.utcnow() + timedelta(hours=24),
-        'iat': datetime.utcnow()
+        'exp': now + TOKEN_TTL_SECONDS,
+        'iat': now
     }
     
-    token = jwt.encode(payload, SECRET_KEY, algorithm='HS256')
+    token = _JWT.encode(payload, SECRET_KEY, algorithm='HS256')
     return token
 
 
@@ -81,13 +201,27 @@ def verify_token(token: str) -> dict:
         jwt.ExpiredSignatureError: If token has expired
         jwt.InvalidTokenError: If token is invalid
     """
+    key = hashlib.sha256(token.encode('utf-8')).digest()[:16]
+    
+    with _TOKEN_CACHE_LOCK:
+        payload = _TOKEN_CACHE.get(key)
+    
+    if payload is not None:
+        if payload['exp'] > time.time():
+            return payload
+        raise jwt.ExpiredSignatureError('Token has expired')
+    
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        return payload
+        payload = _JWT.decode(token, SECRET_KEY, algorithms=['HS256'])
     except jwt.ExpiredSignatureError:
         raise jwt.ExpiredSignatureError('Token has expired')
     except jwt.InvalidTokenError:
         raise jwt.InvalidTokenError('Invalid token')
+    
+    with _TOKEN_CACHE_LOCK:
+        _TOKEN_CACHE[key] = payload
+    
+    return payload
 
 
 # Authentication decorator
@@ -143,8 +277,7 @@ def validate_email(email: str) -> bool:
     Returns:
         True if valid, False otherwise
     """
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
+    return _EMAIL_RE.match(email) is not None
 
 
 def validate_password(password: str) -> tuple[bool, str]:
@@ -272,6 +405,10 @@ def login():
         if not verify_password(password, user['password_hash']):
             return jsonify({'success': False, 'error': 'Invalid credentials'}), 401
         
+        # Upgrade legacy or outdated hashes now that we have the plain password
+        if password_needs_rehash(user['password_hash']):
+            update_user_password_hash(user['id'], hash_password(password))
+        
         # Generate token
         token = generate_token(user['id'])
         
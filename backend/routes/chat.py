@@ -1,20 +1,32 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app
 from functools import wraps
+from concurrent.futures import Future
+from typing import Dict, Optional
+import logging
+import orjson
 import re
+import threading
 from urllib.parse import urlparse
 from backend.routes.auth import require_auth
 from backend.utils.db import (
-    create_chat, get_user_chats, get_chat_messages, add_message,
-    update_chat_timestamp, save_chat_metadata, get_chat_metadata, get_db
+    create_chat, get_user_chats_with_previews, get_chat_messages, persist_turn,
+    save_chat_metadata, get_chat_metadata, get_db, stream_chat_messages,
+    get_messages_if_owner, get_chat_memory, save_chat_memory
 )
-from backend.utils.scraper import WebScraper
-from backend.utils.openai_helper import OpenAIHelper
+from backend.utils.scraper import WebScraper, canonicalize_url
+from backend.utils.openai_helper import HISTORY_COMPACT_KEEP
 
 chat_bp = Blueprint('chat', __name__)
 
-# Initialize scraper and OpenAI helper
+logger = logging.getLogger(__name__)
+
+# Initialize scraper (the shared OpenAI helper is created in create_app)
 scraper = WebScraper()
-openai_helper = OpenAIHelper()
+
+# Scrapes currently in flight, so concurrent requests for the same URL share
+# one (recent results are cached by WebScraper itself). This is per-process.
+_SCRAPE_INFLIGHT: Dict[str, Future] = {}
+_SCRAPE_LOCK = threading.Lock()
 
 
 # Validation functions
@@ -97,6 +109,42 @@ def handle_errors(f):
     return decorated_function
 
 
+# Helper function to start scraping a URL, sharing concurrent scrapes
+def start_scrape(url: str) -> Future:
+    """
+    Start scraping a URL in the background, joining an in-flight scrape of
+    the same URL when there is one (WebScraper itself caches recent results)
+    
+    In-flight scrapes are keyed by the canonical URL, the same key as
+    WebScraper's result cache, so variants of a URL share one scrape.
+    
+    Args:
+        url: URL to scrape
+        
+    Returns:
+        Future resolving to a dictionary with the same structure as
+        WebScraper.scrape_url()
+    """
+    key = canonicalize_url(url)
+    with _SCRAPE_LOCK:
+        future = _SCRAPE_INFLIGHT.get(key)
+        if future is not None:
+            return future
+        
+        # Runs on the scraper's event loop; no worker thread is held
+        future = scraper.scrape_future(url)
+        _SCRAPE_INFLIGHT[key] = future
+    
+    def forget(done: Future) -> None:
+        with _SCRAPE_LOCK:
+            if _SCRAPE_INFLIGHT.get(key) is done:
+                del _SCRAPE_INFLIGHT[key]
+    
+    # Registered outside the lock: it runs immediately if already done
+    future.add_done_callback(forget)
+    return future
+
+
 # Helper function to verify chat ownership
 def verify_chat_ownership(chat_id: str, user_id: int) -> bool:
     """
@@ -114,84 +162,92 @@ def verify_chat_ownership(chat_id: str, user_id: int) -> bool:
     
     cursor.execute('SELECT user_id FROM chats WHERE id = ?', (chat_id,))
     row = cursor.fetchone()
-    conn.close()
     
     if row and row['user_id'] == user_id:
         return True
     return False
 
 
-# Chat endpoints
-
-@chat_bp.route('/message', methods=['POST'])
-@require_auth
-@handle_errors
-def send_message():
+# Helper function shared by the message endpoints
+def prepare_turn(data: dict, user_id: int) -> tuple[Optional[dict], Optional[tuple]]:
     """
-    Send a message in a chat session
+    Validate a message request and gather everything needed to generate a
+    response: the chat session, conversation history and website content
     
-    Request Body:
-        {
-            "chat_id": "uuid-string" (optional, creates new chat if not provided),
-            "url": "https://example.com" (optional),
-            "prompt": "What information do you need?"
-        }
-    
-    Response:
-        {
-            "success": true,
-            "response": "AI response text",
-            "chat_id": "uuid-string"
-        }
+    Args:
+        data: Parsed JSON request body
+        user_id: Authenticated user's ID
+        
+    Returns:
+        Tuple of (turn, error_response). turn has 'chat_id', 'prompt',
+        'website_content' and 'conversation_history'; error_response is a
+        (response, status) pair to return as-is when validation fails.
     """
-    data = request.get_json()
-    
     # Validate required fields
     if not data:
-        return jsonify({'success': False, 'error': 'No data provided'}), 400
+        return None, (jsonify({'success': False, 'error': 'No data provided'}), 400)
     
     # Sanitize inputs
     prompt = sanitize_input(data.get('prompt', ''))
     if not prompt:
-        return jsonify({'success': False, 'error': 'Prompt is required'}), 400
+        return None, (jsonify({'success': False, 'error': 'Prompt is required'}), 400)
     
     chat_id = sanitize_input(data.get('chat_id', '')) if data.get('chat_id') else None
     url = sanitize_input(data.get('url', ''))
-    user_id = request.current_user_id
     
     # Validate URL if provided
     if url:
         is_valid, error_msg = validate_url(url)
         if not is_valid:
-            return jsonify({'success': False, 'error': error_msg}), 400
+            return None, (jsonify({'success': False, 'error': error_msg}), 400)
     
     # Get or create chat session
     if chat_id:
-        # Verify chat ownership
-        if not verify_chat_ownership(chat_id, user_id):
-            return jsonify({'success': False, 'error': 'Chat not found or access denied'}), 404
+        # Load previous messages, enforcing chat ownership in the same query
+        previous_messages = get_messages_if_owner(chat_id, user_id)
+        if previous_messages is None:
+            return None, (jsonify({'success': False, 'error': 'Chat not found or access denied'}), 404)
     else:
         # Create new chat session
         chat_id = create_chat(user_id)
+        previous_messages = []
     
-    # Get previous messages for conversation context
-    previous_messages = get_chat_messages(chat_id)
+    # Start scraping now so the page loads while the conversation history
+    # is prepared (which may include summarizing older turns)
+    scrape_future = start_scrape(url) if url else None
+    
+    # Previous messages for conversation context
     conversation_history = [
         {"role": msg['role'], "content": msg['content']}
         for msg in previous_messages
     ]
     
+    # Replace already-summarized messages with their stored memory, and
+    # summarize further once the conversation grows long enough. The full
+    # transcript stays in the messages table.
+    openai_helper = current_app.extensions['openai_helper']
+    memory = get_chat_memory(chat_id) if previous_messages else None
+    if memory:
+        conversation_history = [
+            openai_helper.memory_message(memory['summary']),
+            *conversation_history[memory['message_count']:]
+        ]
+    
+    conversation_history, summary = openai_helper.compact_history(conversation_history)
+    if summary is not None:
+        save_chat_memory(chat_id, summary, len(previous_messages) - HISTORY_COMPACT_KEEP)
+    
     # Handle web scraping
     website_content = None
-    if url:
-        # Scrape the new URL
-        scrape_result = scraper.scrape_sync(url)
+    if scrape_future is not None:
+        # Wait for the scrape started above
+        scrape_result = scrape_future.result()
         
         if not scrape_result['success']:
-            return jsonify({
+            return None, (jsonify({
                 'success': False,
                 'error': f"Failed to scrape website: {scrape_result['error']}"
-            }), 400
+            }), 400)
         
         website_content = scrape_result['content']
         
@@ -203,11 +259,66 @@ def send_message():
         if metadata and metadata.get('last_scraped_content'):
             website_content = metadata['last_scraped_content']
     
+    return {
+        'chat_id': chat_id,
+        'prompt': prompt,
+        'website_content': website_content,
+        'conversation_history': conversation_history
+    }, None
+
+
+# Helper function to format server-sent events
+def format_sse(data: dict, event: str = None) -> bytes:
+    """
+    Format a server-sent event
+    
+    Args:
+        data: Event payload, sent as JSON
+        event: Event name (optional, defaults to "message" on the client)
+        
+    Returns:
+        Encoded event ready to write to the response stream
+    """
+    prefix = f'event: {event}\n'.encode('utf-8') if event else b''
+    return prefix + b'data: ' + orjson.dumps(data) + b'\n\n'
+
+
+# Chat endpoints
+
+@chat_bp.route('/message', methods=['POST'])
+@require_auth
+@handle_errors
+def send_message():
+    """
+    Send a message in a chat session
+    
+    Request Body:
+        {
+            "chat_id": "uuid-string" (optional, creates new chat if not provided),
+            "url": "https://example.com" (optional),
+            "prompt": "What information do you need?"
+        }
+    
+    Response:
+        {
+            "success": true,
+            "response": "AI response text",
+            "chat_id": "uuid-string"
+        }
+    """
+    turn, error_response = prepare_turn(request.get_json(), request.current_user_id)
+    if error_response:
+        return error_response
+    
+    chat_id = turn['chat_id']
+    prompt = turn['prompt']
+    
     # Generate AI response
+    openai_helper = current_app.extensions['openai_helper']
     ai_result = openai_helper.generate_response(
         user_prompt=prompt,
-        website_content=website_content,
-        conversation_history=conversation_history
+        website_content=turn['website_content'],
+        conversation_history=turn['conversation_history']
     )
     
     if not ai_result['success']:
@@ -216,14 +327,8 @@ def send_message():
             'error': f"Failed to generate response: {ai_result['error']}"
         }), 500
     
-    # Save user message
-    add_message(chat_id, 'user', prompt)
-    
-    # Save AI response
-    add_message(chat_id, 'assistant', ai_result['response'])
-    
-    # Update chat timestamp
-    update_chat_timestamp(chat_id)
+    # Save user message and AI response, and update chat timestamp
+    persist_turn(chat_id, prompt, ai_result['response'])
     
     return jsonify({
         'success': True,
@@ -232,6 +337,65 @@ def send_message():
     }), 200
 
 
+@chat_bp.route('/message/stream', methods=['POST'])
+@require_auth
+@handle_errors
+def send_message_stream():
+    """
+    Send a message in a chat session and stream the AI response as
+    server-sent events
+    
+    Request Body:
+        Same as /message
+    
+    Response (text/event-stream):
+        data: {"delta": "partial response text"}
+        ...
+        event: done
+        data: {"chat_id": "uuid-string"}
+    
+    If generation fails part-way, or the turn can't be saved, an "error"
+    event is sent instead of "done" and nothing is saved. Validation errors are returned as regular
+    JSON responses, as for /message.
+    """
+    turn, error_response = prepare_turn(request.get_json(), request.current_user_id)
+    if error_response:
+        return error_response
+    
+    chat_id = turn['chat_id']
+    prompt = turn['prompt']
+    openai_helper = current_app.extensions['openai_helper']
+    
+    def generate():
+        parts = []
+        try:
+            for delta in openai_helper.generate_response_stream(
+                user_prompt=prompt,
+                website_content=turn['website_content'],
+                conversation_history=turn['conversation_history']
+            ):
+                parts.append(delta)
+                yield format_sse({'delta': delta})
+        except Exception as e:
+            logger.exception("OpenAI API error while streaming")
+            yield format_sse({'error': f"Failed to generate response: {str(e)}"}, event='error')
+            return
+        
+        # Save user message and AI response, and update chat timestamp.
+        # handle_errors only covers the view, not this generator, so a
+        # failure here must be reported to the client as an event.
+        try:
+            persist_turn(chat_id, prompt, ''.join(parts))
+        except Exception:
+            logger.exception("Failed to save streamed chat turn")
+            yield format_sse({'error': 'Failed to save response'}, event='error')
+            return
+        
+        yield format_sse({'chat_id': chat_id}, event='done')
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+
+
 @chat_bp.route('/history', methods=['GET'])
 @require_auth
 @handle_errors
@@ -254,26 +418,18 @@ def get_history():
     """
     user_id = request.current_user_id
     
-    # Get all chats for user
-    chats = get_user_chats(user_id)
+    # Get all chats for user, each with a preview of its first message
+    chats = get_user_chats_with_previews(user_id)
     
-    # Add preview for each chat
-    chat_list = []
-    for chat in chats:
-        messages = get_chat_messages(chat['id'])
-        preview = 'New Chat'
-        
-        if messages and len(messages) > 0:
-            # Use first user message as preview
-            first_message = messages[0]['content']
-            preview = first_message[:50] + ('...' if len(first_message) > 50 else '')
-        
-        chat_list.append({
+    chat_list = [
+        {
             'chat_id': chat['id'],
             'created_at': chat['created_at'],
             'updated_at': chat['updated_at'],
-            'preview': preview
-        })
+            'preview': chat['preview'] or 'New Chat'
+        }
+        for chat in chats
+    ]
     
     return jsonify({
         'success': True,
@@ -288,6 +444,9 @@ def get_chat(chat_id):
     """
     Get a specific chat session with all messages
     
+    Headers:
+        Accept: application/x-ndjson (optional, streams one message per line)
+    
     Response:
         {
             "success": true,
@@ -301,6 +460,10 @@ def get_chat(chat_id):
                 }
             ]
         }
+    
+    NDJSON Response:
+        {"id": 1, "role": "user", "content": "Message content", ...}
+        {"id": 2, "role": "assistant", "content": "Reply content", ...}
     """
     user_id = request.current_user_id
     
@@ -308,6 +471,14 @@ def get_chat(chat_id):
     if not verify_chat_ownership(chat_id, user_id):
         return jsonify({'success': False, 'error': 'Chat not found or access denied'}), 404
     
+    # Stream messages straight from the cursor if the client asked for NDJSON
+    if request.accept_mimetypes.best == 'application/x-ndjson':
+        def generate():
+            for message in stream_chat_messages(chat_id):
+                yield orjson.dumps(message) + b'\n'
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
     # Get all messages for the chat
     messages = get_chat_messages(chat_id)
     
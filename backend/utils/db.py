@@ -1,18 +1,50 @@
 import sqlite3
-from datetime import datetime
 import uuid
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator
+from flask import g
+import zstandard as zstd
 
 DATABASE = 'database.db'
 
+# Scraped page content is stored zstd-compressed in chat_metadata
+_CCTX = zstd.ZstdCompressor(level=3)
+_DCTX = zstd.ZstdDecompressor()
+
+# Applied to every new connection. WAL lets readers proceed while a write is
+# in progress; the rest trade durability-on-power-loss and memory for speed.
+_CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-65536',
+)
+
 
 def get_db() -> sqlite3.Connection:
-    """Get database connection with row factory"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    """
+    Get the database connection for the current app context
+    
+    The connection is opened on first use, reused for the rest of the
+    request, and closed by close_db() on app context teardown.
+    """
+    conn = g.get('_db')
+    if conn is None:
+        conn = sqlite3.connect(DATABASE, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        for pragma in _CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        g._db = conn
     return conn
 
 
+def close_db(exception: Optional[BaseException] = None) -> None:
+    """Close the database connection for the current app context, if any"""
+    conn = g.pop('_db', None)
+    if conn is not None:
+        conn.close()
+
+
 def sanitize_db_input(text: str) -> str:
     """
     Sanitize input before database insertion
@@ -26,13 +58,13 @@ def sanitize_db_input(text: str) -> str:
     if not text:
         return ''
     
-    # Remove null bytes which can cause issues with SQLite
-    text = text.replace('\x00', '')
+    # Remove null bytes which can cause issues with SQLite. The membership
+    # test is a fast scan and avoids copying the string in the common case.
+    if '\x00' in text:
+        text = text.replace('\x00', '')
     
     # Strip leading/trailing whitespace
-    text = text.strip()
-    
-    return text
+    return text.strip()
 
 
 def init_db() -> None:
@@ -79,13 +111,52 @@ def init_db() -> None:
         CREATE TABLE IF NOT EXISTS chat_metadata (
             chat_id TEXT PRIMARY KEY,
             last_url TEXT,
-            last_scraped_content TEXT,
+            last_scraped_content BLOB,
             FOREIGN KEY (chat_id) REFERENCES chats(id)
         )
     ''')
     
-    conn.commit()
-    conn.close()
+    # Chat memory table (summary of older messages, see compact_history)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_memory (
+            chat_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            message_count INTEGER NOT NULL,
+            FOREIGN KEY (chat_id) REFERENCES chats(id)
+        )
+    ''')
+    
+    # Rows written before timestamps were generated in SQL hold naive local
+    # time (datetime.now().isoformat()). Convert them once to the same UTC
+    # "...Z" format so chats.updated_at sorts correctly. This assumes the
+    # database is still on the host (and time zone) that wrote them.
+    if conn.execute('PRAGMA user_version').fetchone()[0] < 1:
+        conn.execute('BEGIN')
+        with conn:
+            for table, column in (('chats', 'created_at'), ('chats', 'updated_at'),
+                                  ('messages', 'timestamp')):
+                conn.execute(f'''
+                    UPDATE {table}
+                    SET {column} = CASE
+                        WHEN {column} LIKE '%T%' THEN strftime('%Y-%m-%dT%H:%M:%fZ', {column}, 'utc')
+                        ELSE strftime('%Y-%m-%dT%H:%M:%fZ', {column})
+                    END
+                    WHERE {column} IS NOT NULL AND {column} NOT LIKE '%Z'
+                ''')
+            conn.execute('PRAGMA user_version = 1')
+    
+    # Indexes matching the lookup and ordering used by the query helpers.
+    # Messages are ordered by id (AUTOINCREMENT), which is monotonic even
+    # when a user message and its reply share a timestamp; an index on
+    # chat_id alone already keeps each chat's rows in id order.
+    cursor.execute('DROP INDEX IF EXISTS idx_messages_chat_ts')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages(chat_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chats_user_updated ON chats(user_id, updated_at DESC)')
+    # Already implied by the UNIQUE constraint on users.email; kept explicit
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users(email)')
+    
+    # Refresh planner statistics so the indexes above get picked
+    cursor.execute('ANALYZE')
 
 
 # User operations
@@ -115,8 +186,6 @@ def create_user(email: str, username: str, password_hash: str) -> int:
     )
     
     user_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
     
     return user_id
 
@@ -136,7 +205,6 @@ def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
     
     cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
     row = cursor.fetchone()
-    conn.close()
     
     if row:
         return dict(row)
@@ -158,13 +226,29 @@ def get_user_by_id(user_id: int) -> Optional[Dict[str, Any]]:
     
     cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
     row = cursor.fetchone()
-    conn.close()
     
     if row:
         return dict(row)
     return None
 
 
+def update_user_password_hash(user_id: int, password_hash: str) -> None:
+    """
+    Replace a user's stored password hash
+    
+    Args:
+        user_id: User's ID
+        password_hash: New hashed password
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        'UPDATE users SET password_hash = ? WHERE id = ?',
+        (password_hash, user_id)
+    )
+
+
 # Chat operations
 
 def create_chat(user_id: int) -> str:
@@ -181,16 +265,14 @@ def create_chat(user_id: int) -> str:
     cursor = conn.cursor()
     
     chat_id = str(uuid.uuid4())
-    timestamp = datetime.now().isoformat()
     
+    # Timestamps are generated by SQLite (UTC, ISO 8601)
     cursor.execute(
-        'INSERT INTO chats (id, user_id, created_at, updated_at) VALUES (?, ?, ?, ?)',
-        (chat_id, user_id, timestamp, timestamp)
+        '''INSERT INTO chats (id, user_id, created_at, updated_at)
+           VALUES (?, ?, strftime('%Y-%m-%dT%H:%M:%fZ', 'now'), strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))''',
+        (chat_id, user_id)
     )
     
-    conn.commit()
-    conn.close()
-    
     return chat_id
 
 
@@ -213,7 +295,39 @@ def get_user_chats(user_id: int) -> List[Dict[str, Any]]:
     )
     
     rows = cursor.fetchall()
-    conn.close()
+    
+    return [dict(row) for row in rows]
+
+
+def get_user_chats_with_previews(user_id: int) -> List[Dict[str, Any]]:
+    """
+    Retrieve all chat sessions for a user along with a preview of each
+    chat's first message, in a single query
+    
+    Args:
+        user_id: User's ID
+        
+    Returns:
+        List of dictionaries containing chat data and 'preview'
+        (None if the chat has no messages)
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT c.id, c.created_at, c.updated_at,
+               CASE WHEN LENGTH(m.content) > 50
+                    THEN SUBSTR(m.content, 1, 50) || '...'
+                    ELSE m.content
+               END AS preview
+        FROM chats c
+        LEFT JOIN messages m
+            ON m.id = (SELECT MIN(id) FROM messages WHERE chat_id = c.id)
+        WHERE c.user_id = ?
+        ORDER BY c.updated_at DESC
+    ''', (user_id,))
+    
+    rows = cursor.fetchall()
     
     return [dict(row) for row in rows]
 
@@ -232,16 +346,77 @@ def get_chat_messages(chat_id: str) -> List[Dict[str, Any]]:
     cursor = conn.cursor()
     
     cursor.execute(
-        'SELECT * FROM messages WHERE chat_id = ? ORDER BY timestamp ASC',
+        'SELECT * FROM messages WHERE chat_id = ? ORDER BY id ASC',
         (chat_id,)
     )
     
     rows = cursor.fetchall()
-    conn.close()
     
     return [dict(row) for row in rows]
 
 
+def get_messages_if_owner(chat_id: str, user_id: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Retrieve the role and content of all messages in a chat session, but
+    only if the chat belongs to the given user
+    
+    Args:
+        chat_id: Chat session ID
+        user_id: User ID
+        
+    Returns:
+        List of dictionaries with 'role' and 'content' (empty for a chat
+        with no messages yet), or None if the chat does not exist or
+        belongs to another user
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT m.role, m.content FROM messages m
+        JOIN chats c ON c.id = m.chat_id
+        WHERE m.chat_id = ? AND c.user_id = ?
+        ORDER BY m.id ASC
+    ''', (chat_id, user_id))
+    
+    rows = cursor.fetchall()
+    
+    if rows:
+        return [dict(row) for row in rows]
+    
+    # No rows: distinguish an owned chat with no messages from a missing
+    # or foreign chat
+    cursor.execute('SELECT 1 FROM chats WHERE id = ? AND user_id = ?', (chat_id, user_id))
+    if cursor.fetchone():
+        return []
+    return None
+
+
+def stream_chat_messages(chat_id: str) -> Iterator[Dict[str, Any]]:
+    """
+    Iterate over the messages of a chat session without loading them all
+    
+    Rows are pulled from the cursor one at a time, so memory use does not
+    grow with the number of messages.
+    
+    Args:
+        chat_id: Chat session ID
+        
+    Yields:
+        Dictionaries containing message data
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        'SELECT * FROM messages WHERE chat_id = ? ORDER BY id ASC',
+        (chat_id,)
+    )
+    
+    for row in cursor:
+        yield dict(row)
+
+
 def add_message(chat_id: str, role: str, content: str) -> None:
     """
     Add a message to a chat session
@@ -254,18 +429,48 @@ def add_message(chat_id: str, role: str, content: str) -> None:
     conn = get_db()
     cursor = conn.cursor()
     
-    timestamp = datetime.now().isoformat()
-    
     # Sanitize content (chat_id and role are controlled by the application)
     content = sanitize_db_input(content)
     
     cursor.execute(
-        'INSERT INTO messages (chat_id, role, content, timestamp) VALUES (?, ?, ?, ?)',
-        (chat_id, role, content, timestamp)
+        '''INSERT INTO messages (chat_id, role, content, timestamp)
+           VALUES (?, ?, ?, strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))''',
+        (chat_id, role, content)
     )
+
+
+def persist_turn(chat_id: str, user_prompt: str, assistant_reply: str) -> None:
+    """
+    Save a user prompt and the assistant's reply and bump the chat's
+    updated_at timestamp, all in a single transaction
+    
+    Args:
+        chat_id: Chat session ID
+        user_prompt: User message content
+        assistant_reply: Assistant message content
+    """
+    conn = get_db()
     
-    conn.commit()
-    conn.close()
+    # Sanitize content (chat_id is controlled by the application)
+    user_prompt = sanitize_db_input(user_prompt)
+    assistant_reply = sanitize_db_input(assistant_reply)
+    
+    # The connection is in autocommit mode, so open the transaction explicitly;
+    # the context manager commits it (or rolls back on error)
+    conn.execute('BEGIN')
+    with conn:
+        conn.executemany(
+            '''INSERT INTO messages (chat_id, role, content, timestamp)
+               VALUES (?, ?, ?, strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))''',
+            [
+                (chat_id, 'user', user_prompt),
+                (chat_id, 'assistant', assistant_reply)
+            ]
+        )
+        conn.execute(
+            "UPDATE chats SET updated_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now') WHERE id = ?",
+            (chat_id,)
+        )
 
 
 def update_chat_timestamp(chat_id: str) -> None:
@@ -278,15 +483,10 @@ def update_chat_timestamp(chat_id: str) -> None:
     conn = get_db()
     cursor = conn.cursor()
     
-    timestamp = datetime.now().isoformat()
-    
     cursor.execute(
-        'UPDATE chats SET updated_at = ? WHERE id = ?',
-        (timestamp, chat_id)
+        "UPDATE chats SET updated_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now') WHERE id = ?",
+        (chat_id,)
     )
-    
-    conn.commit()
-    conn.close()
 
 
 # Chat metadata operations
@@ -303,18 +503,23 @@ def save_chat_metadata(chat_id: str, url: str, content: str) -> None:
     conn = get_db()
     cursor = conn.cursor()
     
-    # Sanitize inputs (chat_id is controlled by the application)
+    # Sanitize the URL (chat_id is controlled by the application). The
+    # content is trusted scrape output and is stored as a compressed blob.
     url = sanitize_db_input(url)
-    content = sanitize_db_input(content)
-    
-    # Use INSERT OR REPLACE to handle both insert and update
-    cursor.execute(
-        'INSERT OR REPLACE INTO chat_metadata (chat_id, last_url, last_scraped_content) VALUES (?, ?, ?)',
-        (chat_id, url, content)
-    )
+    content = _CCTX.compress((content or '').encode('utf-8'))
     
-    conn.commit()
-    conn.close()
+    # Upsert in place (keeps the existing row instead of delete + insert).
+    # The WHERE clause skips the update when nothing changed; the comparison
+    # happens inside SQLite, so the stored content is not read back.
+    cursor.execute('''
+        INSERT INTO chat_metadata (chat_id, last_url, last_scraped_content)
+        VALUES (?, ?, ?)
+        ON CONFLICT(chat_id) DO UPDATE SET
+            last_url = excluded.last_url,
+            last_scraped_content = excluded.last_scraped_content
+        WHERE last_url IS NOT excluded.last_url
+           OR last_scraped_content IS NOT excluded.last_scraped_content
+    ''', (chat_id, url, content))
 
 
 def get_chat_metadata(chat_id: str) -> Optional[Dict[str, Any]]:
@@ -332,7 +537,63 @@ def get_chat_metadata(chat_id: str) -> Optional[Dict[str, Any]]:
     
     cursor.execute('SELECT * FROM chat_metadata WHERE chat_id = ?', (chat_id,))
     row = cursor.fetchone()
-    conn.close()
+    
+    if not row:
+        return None
+    
+    metadata = dict(row)
+    # Rows written before compression was introduced hold plain TEXT
+    if isinstance(metadata['last_scraped_content'], bytes):
+        metadata['last_scraped_content'] = _DCTX.decompress(
+            metadata['last_scraped_content']
+        ).decode('utf-8')
+    return metadata
+
+
+# Chat memory operations
+
+def save_chat_memory(chat_id: str, summary: str, message_count: int) -> None:
+    """
+    Save or update the summary of a chat's older messages
+    
+    Args:
+        chat_id: Chat session ID
+        summary: Summary of the chat's first message_count messages
+        message_count: Number of leading messages the summary replaces
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    summary = sanitize_db_input(summary)
+    
+    cursor.execute('''
+        INSERT INTO chat_memory (chat_id, summary, message_count)
+        VALUES (?, ?, ?)
+        ON CONFLICT(chat_id) DO UPDATE SET
+            summary = excluded.summary,
+            message_count = excluded.message_count
+    ''', (chat_id, summary, message_count))
+
+
+def get_chat_memory(chat_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Retrieve the summary of a chat's older messages
+    
+    Args:
+        chat_id: Chat session ID
+        
+    Returns:
+        Dictionary with 'summary' and 'message_count', or None if the chat
+        has not been compacted
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        'SELECT summary, message_count FROM chat_memory WHERE chat_id = ?',
+        (chat_id,)
+    )
+    row = cursor.fetchone()
     
     if row:
         return dict(row)
@@ -1,23 +1,23 @@
 from openai import OpenAI
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+import atexit
+import hashlib
+import httpx
+import logging
+import orjson
 import os
+import tempfile
+import threading
+import tiktoken
+import time
 
+logger = logging.getLogger(__name__)
 
-class OpenAIHelper:
-    def __init__(self):
-        api_key = os.getenv('OPENAI_API_KEY')
-        api_base = os.getenv('OPENAI_API_BASE')
-        
-        # Initialize OpenAI client with custom base URL if provided
-        if api_base:
-            self.client = OpenAI(api_key=api_key, base_url=api_base)
-        else:
-            self.client = OpenAI(api_key=api_key)
-        
-        # Use gpt-4o-mini for better compatibility with custom API endpoints
-        self.model = "gpt-4o-mini"
-        self.temperature = 0.7
-        
-        self.system_prompt = """You are a web scraping assistant. You analyze website content and extract only the information the user requests. 
+# System prompt sent with every request
+SYSTEM_PROMPT = """You are a web scraping assistant. You analyze website content and extract only the information the user requests. 
 
 Your responses should be:
 - Clear and human-readable (no JSON, XML, or raw data)
@@ -26,6 +26,391 @@ Your responses should be:
 - Concise but complete
 
 If the user asks for specific data points (like prices, names, dates), present them in a clean, readable format."""
+
+# Maximum number of tokens of scraped website content sent to the model
+MAX_WEBSITE_TOKENS = 12000
+
+# Maximum number of tokens of conversation history sent to the model
+MAX_HISTORY_TOKENS = 4000
+
+# Once a conversation is longer than HISTORY_COMPACT_THRESHOLD messages, all
+# but the newest HISTORY_COMPACT_KEEP are summarized into a single memory
+HISTORY_COMPACT_THRESHOLD = 20
+HISTORY_COMPACT_KEEP = 10
+
+# Marks the summary message that replaces compacted turns
+MEMORY_PREFIX = "PREVIOUS_MEMORY:\n"
+
+MEMORY_PROMPT = """Summarize the conversation so far as a compact markdown memory. Keep every fact, figure, URL and user preference needed to continue the conversation; drop pleasantries and repetition."""
+
+
+# Seconds to wait before retrying a tiktoken encoding that failed to load
+ENCODING_RETRY_SECONDS = 300
+
+_encodings: dict[str, tiktoken.Encoding] = {}
+_encoding_failed_at: dict[str, float] = {}
+_encoding_lock = threading.Lock()
+
+
+def _reset_encoding_lock_after_fork() -> None:
+    """Give a forked child its own lock (the parent's may be held mid-load)"""
+    global _encoding_lock
+    _encoding_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_encoding_lock_after_fork)
+
+
+def _get_encoding(model: str) -> Optional[tiktoken.Encoding]:
+    """
+    Load the tiktoken encoding for a model once per process
+    
+    Returns None if the encoding can't be loaded (tiktoken downloads it on
+    first use, which fails on hosts without network access). Only successful
+    loads are kept; a failed load is retried after ENCODING_RETRY_SECONDS.
+    """
+    enc = _encodings.get(model)
+    if enc is not None:
+        return enc
+    
+    # Another thread is loading (possibly downloading) an encoding; use the
+    # estimate for now rather than waiting on it
+    if not _encoding_lock.acquire(blocking=False):
+        return None
+    try:
+        enc = _encodings.get(model)
+        if enc is not None:
+            return enc
+        failed_at = _encoding_failed_at.get(model)
+        if failed_at is not None and time.monotonic() - failed_at < ENCODING_RETRY_SECONDS:
+            return None
+        
+        try:
+            enc = tiktoken.encoding_for_model(model)
+        except Exception as e:
+            logger.warning("Could not load tiktoken encoding for %s: %s", model, e)
+            _encoding_failed_at[model] = time.monotonic()
+            return None
+        
+        _encodings[model] = enc
+        _encoding_failed_at.pop(model, None)
+        return enc
+    finally:
+        _encoding_lock.release()
+
+
+@dataclass(frozen=True)
+class Config:
+    """OpenAI settings, read from the environment once at import"""
+    api_key: Optional[str]
+    api_base: Optional[str]
+    cache_dir: Optional[str]
+
+
+# Imported from create_app(), after load_dotenv() has run
+_CFG = Config(
+    api_key=os.getenv('OPENAI_API_KEY'),
+    api_base=os.getenv('OPENAI_API_BASE'),
+    cache_dir=os.getenv('OPENAI_CACHE_DIR')
+)
+
+
+@dataclass
+class ExtractionCache:
+    """
+    Content-addressable on-disk cache of successful completions.
+    
+    Each entry is a JSON file named by the SHA-256 of its inputs, so identical
+    requests (same model, prompt, history and website content) are answered
+    without calling the API.
+    """
+    cache_dir: Path
+    
+    @staticmethod
+    def make_key(*fields: str | bytes) -> str:
+        """
+        Build a cache key from request fields
+        
+        Each field is length-prefixed (8 bytes, little-endian) before hashing
+        so that different splits of the same bytes cannot collide.
+        """
+        digest = hashlib.sha256()
+        for field in fields:
+            data = field if isinstance(field, bytes) else field.encode('utf-8')
+            digest.update(len(data).to_bytes(8, 'little'))
+            digest.update(data)
+        return digest.hexdigest()
+    
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f'{key}.json'
+    
+    def get(self, key: str) -> Optional[dict]:
+        """Return the cached entry for key, or None if missing or malformed"""
+        try:
+            with open(self._path(key), 'rb') as f:
+                entry = orjson.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        
+        if (not isinstance(entry, dict) or entry.get('success') is not True
+                or not isinstance(entry.get('response'), str)):
+            return None
+        return entry
+    
+    def set(self, key: str, response: str) -> None:
+        """
+        Store a successful response under key
+        
+        Best effort: a failed write (full disk, read-only or missing cache
+        directory) is logged and otherwise ignored, since the response has
+        already been produced.
+        """
+        path = self._path(key)
+        entry = {
+            'success': True,
+            'response': response,
+            'cached_at': datetime.now(timezone.utc).isoformat()
+        }
+        
+        tmp_name = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file and rename so readers never see a partial entry
+            with tempfile.NamedTemporaryFile('wb', dir=path.parent,
+                                             suffix='.tmp', delete=False) as f:
+                tmp_name = f.name
+                f.write(orjson.dumps(entry))
+            os.replace(tmp_name, path)
+        except OSError as e:
+            logger.warning("Could not write extraction cache entry %s: %s", key, e)
+            if tmp_name is not None:
+                try:
+                    os.unlink(tmp_name)
+                except OSError:
+                    pass
+
+
+class OpenAIHelper:
+    __slots__ = ('_http', '_client', '_pid', '_lock', '_warm_up_on_fork', 'cache')
+    
+    # System message shared by every request (the SDK doesn't modify messages)
+    _SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+    
+    # Use gpt-4o-mini for better compatibility with custom API endpoints
+    model = "gpt-4o-mini"
+    temperature = 0.7
+    
+    def __init__(self):
+        # The HTTP pool and OpenAI client are created on first use in each
+        # process (see client), so a forked worker (e.g. under gunicorn
+        # --preload) never shares the parent's open connections
+        self._http: Optional[httpx.Client] = None
+        self._client: Optional[OpenAI] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._warm_up_on_fork = False
+        atexit.register(self.close)
+        os.register_at_fork(after_in_child=self._after_fork_in_child)
+        
+        # Optional response cache, enabled by setting OPENAI_CACHE_DIR
+        self.cache = ExtractionCache(Path(_CFG.cache_dir)) if _CFG.cache_dir else None
+    
+    @property
+    def client(self) -> OpenAI:
+        """OpenAI client for the current process, created on first use"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._connect()
+        return self._client
+    
+    def _connect(self) -> None:
+        """Create the HTTP connection pool and the OpenAI client using it"""
+        # Long-lived HTTP client so connections (and TLS sessions) are reused
+        # across API calls instead of being re-established each time
+        self._http = httpx.Client(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            # Same as the SDK default: fail fast on connect, but leave long
+            # completions (large page + 2000-token reply) time to finish
+            timeout=httpx.Timeout(600.0, connect=5.0),
+            http2=True
+        )
+        
+        # Initialize OpenAI client with custom base URL if provided
+        if _CFG.api_base:
+            self._client = OpenAI(api_key=_CFG.api_key, base_url=_CFG.api_base, http_client=self._http)
+        else:
+            self._client = OpenAI(api_key=_CFG.api_key, http_client=self._http)
+        self._pid = os.getpid()
+    
+    def _after_fork_in_child(self) -> None:
+        """Reset per-process state in a forked child"""
+        # Another thread may have held the lock when the parent forked
+        self._lock = threading.Lock()
+        if self._warm_up_on_fork:
+            self.start_warm_up()
+    
+    def close(self) -> None:
+        """Close this process's HTTP connection pool"""
+        if self._http is not None and self._pid == os.getpid():
+            self._http.close()
+    
+    def start_warm_up(self) -> None:
+        """
+        Run warm_up() in a background thread, in this process and again in
+        every process forked from it (each child makes its own connections)
+        """
+        self._warm_up_on_fork = True
+        threading.Thread(target=self.warm_up, name='openai-warm-up', daemon=True).start()
+    
+    def warm_up(self) -> None:
+        """
+        Connect to the API ahead of the first request
+        
+        Lists the available models so DNS resolution, the TLS handshake and
+        HTTP/2 setup are done before a user is waiting on a response. Errors
+        are only logged; the first real request connects again if needed.
+        """
+        try:
+            self.client.models.list()
+        except Exception as e:
+            logger.warning("OpenAI warm-up request failed: %s", e)
+    
+    def _truncate_website_content(self, website_content: str) -> str:
+        """Cut website content down to MAX_WEBSITE_TOKENS tokens"""
+        # Every token covers at least one UTF-8 byte (byte-level BPE can spend
+        # several tokens on one CJK character or emoji), so content that is
+        # short in bytes can't exceed the budget and doesn't need to be encoded
+        data = website_content.encode('utf-8')
+        if len(data) <= MAX_WEBSITE_TOKENS:
+            return website_content
+        
+        enc = _get_encoding(self.model)
+        if enc is None:
+            # Roughly 4 bytes per token for English text
+            return data[:MAX_WEBSITE_TOKENS * 4].decode('utf-8', errors='ignore')
+        
+        tokens = enc.encode(website_content, disallowed_special=())
+        if len(tokens) <= MAX_WEBSITE_TOKENS:
+            return website_content
+        return enc.decode(tokens[:MAX_WEBSITE_TOKENS])
+    
+    def _count_tokens(self, text: str) -> int:
+        """Count the tokens in text (estimated if no encoding is available)"""
+        enc = _get_encoding(self.model)
+        if enc is None:
+            # Roughly 4 bytes per token for English text
+            return len(text.encode('utf-8')) // 4 + 1
+        return len(enc.encode(text, disallowed_special=()))
+    
+    def _trim_history(self, history: list, budget: int = MAX_HISTORY_TOKENS) -> list:
+        """
+        Keep only the most recent messages whose combined size fits the budget
+        
+        A leading PREVIOUS_MEMORY message (see compact_history) stands in for
+        every older turn, so it is always kept and counted first; only the
+        turns after it are trimmed.
+        
+        Args:
+            history: Conversation messages, oldest first
+            budget: Maximum total tokens to keep
+            
+        Returns:
+            The memory message (if any) and the newest turns that fit, oldest first
+        """
+        kept = []
+        used = 0
+        memory = None
+        if history and self.is_memory_message(history[0]):
+            memory = history[0]
+            used = self._count_tokens(memory['content'])
+            history = history[1:]
+        
+        for message in reversed(history):
+            used += self._count_tokens(message['content'])
+            if used > budget:
+                break
+            kept.append(message)
+        if memory is not None:
+            kept.append(memory)
+        kept.reverse()
+        return kept
+    
+    @staticmethod
+    def memory_message(summary: str) -> dict:
+        """Wrap a conversation summary as a message to stand in for old turns"""
+        return {"role": "assistant", "content": f"{MEMORY_PREFIX}{summary}"}
+    
+    @staticmethod
+    def is_memory_message(message: dict) -> bool:
+        """Return True if message was built by memory_message"""
+        return (message.get('role') == 'assistant'
+                and message.get('content', '').startswith(MEMORY_PREFIX))
+    
+    def compact_history(self, history: list) -> tuple[list, Optional[str]]:
+        """
+        Summarize old conversation turns into a single memory message
+        
+        If history has more than HISTORY_COMPACT_THRESHOLD messages, all but
+        the newest HISTORY_COMPACT_KEEP are replaced by a summary.
+        
+        Args:
+            history: Conversation messages, oldest first
+            
+        Returns:
+            Tuple of (history, summary). summary is None and history is
+            returned unchanged if nothing was compacted (including when the
+            summarization call fails).
+        """
+        if len(history) <= HISTORY_COMPACT_THRESHOLD:
+            return history, None
+        
+        old = history[:-HISTORY_COMPACT_KEEP]
+        recent = history[-HISTORY_COMPACT_KEEP:]
+        
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "system", "content": MEMORY_PROMPT}, *old],
+                temperature=0
+            )
+            summary = response.choices[0].message.content
+        except Exception:
+            logger.exception("OpenAI API error while compacting history")
+            return history, None
+        
+        return [self.memory_message(summary), *recent], summary
+    
+    def _build_messages(self, user_prompt: str, website_content: str = None,
+                        conversation_history: list = None) -> list:
+        """Build the chat messages for a request"""
+        messages = [self._SYSTEM_MSG]
+        
+        # Add the most recent conversation history that fits the token budget
+        if conversation_history:
+            messages.extend(self._trim_history(conversation_history))
+        
+        # Build user message
+        user_message = user_prompt
+        if website_content:
+            website_content = self._truncate_website_content(website_content)
+            user_message = f"Website Content:\n\n{website_content}\n\nUser Request: {user_prompt}"
+        
+        messages.append({"role": "user", "content": user_message})
+        return messages
+    
+    def _cache_key(self, user_prompt: str, website_content: str = None,
+                   conversation_history: list = None) -> Optional[str]:
+        """Build the response cache key for a request, or None if caching is off"""
+        if self.cache is None:
+            return None
+        return ExtractionCache.make_key(
+            self.model,
+            SYSTEM_PROMPT,
+            orjson.dumps(conversation_history or []),
+            user_prompt,
+            website_content or ''
+        )
     
     def generate_response(self, user_prompt: str, website_content: str = None, 
                          conversation_history: list = None) -> dict:
@@ -45,18 +430,18 @@ If the user asks for specific data points (like prices, names, dates), present t
             }
         """
         try:
-            messages = [{"role": "system", "content": self.system_prompt}]
-            
-            # Add conversation history
-            if conversation_history:
-                messages.extend(conversation_history)
+            messages = self._build_messages(user_prompt, website_content, conversation_history)
             
-            # Build user message
-            user_message = user_prompt
-            if website_content:
-                user_message = f"Website Content:\n\n{website_content}\n\nUser Request: {user_prompt}"
-            
-            messages.append({"role": "user", "content": user_message})
+            # Return a cached response for identical inputs, if caching is enabled
+            cache_key = self._cache_key(user_prompt, website_content, conversation_history)
+            if cache_key is not None:
+                entry = self.cache.get(cache_key)
+                if entry is not None:
+                    return {
+                        'success': True,
+                        'response': entry['response'],
+                        'error': None
+                    }
             
             # Call OpenAI API
             response = self.client.chat.completions.create(
@@ -66,20 +451,69 @@ If the user asks for specific data points (like prices, names, dates), present t
                 max_tokens=2000
             )
             
+            content = response.choices[0].message.content
+            
+            if cache_key is not None:
+                self.cache.set(cache_key, content)
+            
             return {
                 'success': True,
-                'response': response.choices[0].message.content,
+                'response': content,
                 'error': None
             }
             
         except Exception as e:
             # Log the full error for debugging
-            print(f"OpenAI API Error: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("OpenAI API error")
             
             return {
                 'success': False,
                 'response': '',
                 'error': str(e)
             }
+    
+    def generate_response_stream(self, user_prompt: str, website_content: str = None,
+                                 conversation_history: list = None) -> Iterator[str]:
+        """
+        Generate AI response incrementally, yielding text as it arrives
+        
+        Args:
+            user_prompt: User's question or request
+            website_content: Scraped website content (optional)
+            conversation_history: Previous messages for context (optional)
+            
+        Yields:
+            Chunks of response text
+            
+        Raises:
+            Exception: Any error from the OpenAI API is propagated to the caller
+        """
+        messages = self._build_messages(user_prompt, website_content, conversation_history)
+        
+        # A cached response is yielded as a single chunk
+        cache_key = self._cache_key(user_prompt, website_content, conversation_history)
+        if cache_key is not None:
+            entry = self.cache.get(cache_key)
+            if entry is not None:
+                yield entry['response']
+                return
+        
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=2000,
+            stream=True
+        )
+        
+        parts = []
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+        
+        if cache_key is not None:
+            self.cache.set(cache_key, ''.join(parts))
@@ -2,25 +2,147 @@
 Web scraping module using Crawl4AI for content extraction.
 """
 
-from crawl4ai import AsyncWebCrawler
+from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode
+from crawl4ai import DefaultMarkdownGenerator
+from cachetools import TTLCache
+from concurrent.futures import Future
 import asyncio
-from typing import Dict
+import atexit
+import functools
+import hashlib
+import threading
+from typing import Dict, List, Optional
 import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# The lxml implementation (newer crawl4ai releases) gives identical output faster
+try:
+    from crawl4ai import PruningContentFilterLXML as PruningContentFilter
+except ImportError:
+    from crawl4ai import PruningContentFilter
+
+# Run the background event loop on uvloop where available; it is not
+# supported on Windows
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+# Any whitespace character; URLs containing one are rejected
+_WHITESPACE_RE = re.compile(r'\s')
+
+
+@functools.lru_cache(maxsize=1024)
+def canonicalize_url(url: str) -> str:
+    """
+    Normalize a URL for use as a cache key, so URLs that only differ in
+    case, fragment, tracking parameters or parameter order share an entry
+    
+    Lowercases the scheme and host, drops the fragment and utm_* query
+    parameters, and sorts the remaining parameters. A URL that can't be
+    parsed is returned unchanged.
+    """
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    userinfo, at, host = parts.netloc.rpartition('@')
+    query = urlencode(sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.startswith('utm_')
+    ))
+    return urlunsplit((parts.scheme.lower(), userinfo + at + host.lower(), parts.path, query, ''))
 
 
 class WebScraper:
     """
     Web scraper class that uses Crawl4AI to extract content from websites.
+    
+    A single AsyncWebCrawler (and its browser) is kept alive on a background
+    event loop thread and reused for every scrape. The loop and the browser
+    are started lazily on first use, so a WebScraper created before a server
+    forks its workers is still safe to use in each worker.
     """
     
+    __slots__ = (
+        '_loop', '_loop_lock', '_crawler', '_crawler_lock',
+        '_run_cfg', '_result_cache', '_batch_semaphore'
+    )
+    
     def __init__(self):
         """Initialize the WebScraper."""
-        pass
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+        self._crawler: Optional[AsyncWebCrawler] = None
+        self._crawler_lock: Optional[asyncio.Lock] = None
+        # Prune boilerplate (navigation, footers, link farms) while generating
+        # markdown so only the page's main content is kept and sent on.
+        # crawl4ai's disk cache is bypassed: its entries never expire, so it
+        # would serve stale pages forever (recent results are cached below).
+        self._run_cfg = CrawlerRunConfig(
+            cache_mode=CacheMode.BYPASS,
+            word_count_threshold=10,
+            markdown_generator=DefaultMarkdownGenerator(
+                content_filter=PruningContentFilter(
+                    threshold=0.48, threshold_type='fixed', min_word_threshold=0
+                )
+            )
+        )
+        # In-memory cache of successful scrapes keyed by the sha256 of the
+        # canonical URL; pages are fetched again once an entry is 15 minutes
+        # old. Only touched from the background loop.
+        self._result_cache = TTLCache(maxsize=512, ttl=900)
+        # Caps concurrent page loads in scrape_urls() so the browser isn't swamped
+        self._batch_semaphore = asyncio.Semaphore(8)
+        atexit.register(self.close)
+    
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """Start the background event loop thread if it is not running yet."""
+        with self._loop_lock:
+            if self._loop is None:
+                loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever, name='web-scraper-loop', daemon=True
+                )
+                thread.start()
+                self._loop = loop
+            return self._loop
+    
+    async def _get_crawler(self) -> AsyncWebCrawler:
+        """Return the shared crawler, starting the browser on first use."""
+        if self._crawler_lock is None:
+            self._crawler_lock = asyncio.Lock()
+        
+        async with self._crawler_lock:
+            if self._crawler is None:
+                crawler = AsyncWebCrawler(config=BrowserConfig(headless=True, verbose=False))
+                await crawler.start()
+                self._crawler = crawler
+            return self._crawler
+    
+    def close(self) -> None:
+        """Shut down the shared crawler and stop the background event loop."""
+        with self._loop_lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        
+        if self._crawler is not None:
+            crawler, self._crawler = self._crawler, None
+            try:
+                asyncio.run_coroutine_threadsafe(crawler.close(), loop).result(timeout=10)
+            except Exception:
+                pass
+        loop.call_soon_threadsafe(loop.stop)
     
     async def scrape_url(self, url: str) -> Dict[str, any]:
         """
         Asynchronously scrape a website and extract its content in markdown format.
         
+        Must run on the scraper's background event loop (see scrape_sync()).
+        
         Args:
             url: The target website URL to scrape
             
@@ -40,27 +162,38 @@ class WebScraper:
                 'error': 'Invalid URL format'
             }
         
+        # Serve recent successful scrapes without rendering the page again
+        cache_key = hashlib.sha256(canonicalize_url(url).encode('utf-8')).digest()
+        cached = self._result_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+        
         try:
-            # Create crawler instance
-            async with AsyncWebCrawler(verbose=False) as crawler:
-                # Run the crawler
-                result = await crawler.arun(url=url)
-                
-                if result.success:
-                    return {
-                        'success': True,
-                        'content': result.markdown or '',
-                        'title': result.metadata.get('title', '') if result.metadata else '',
-                        'error': None
-                    }
-                else:
-                    return {
-                        'success': False,
-                        'content': '',
-                        'title': '',
-                        'error': result.error_message or 'Failed to scrape website'
-                    }
-                    
+            # Run the shared crawler
+            crawler = await self._get_crawler()
+            result = await crawler.arun(url=url, config=self._run_cfg)
+            
+            if result.success:
+                # Prefer the pruned markdown, falling back to the full page
+                # if the filter removed everything
+                markdown = result.markdown
+                content = getattr(markdown, 'fit_markdown', None) or markdown or ''
+                scraped = {
+                    'success': True,
+                    'content': str(content),
+                    'title': result.metadata.get('title', '') if result.metadata else '',
+                    'error': None
+                }
+                self._result_cache[cache_key] = scraped
+                return dict(scraped)
+            else:
+                return {
+                    'success': False,
+                    'content': '',
+                    'title': '',
+                    'error': result.error_message or 'Failed to scrape website'
+                }
+            
         except Exception as e:
             return {
                 'success': False,
@@ -69,10 +202,26 @@ class WebScraper:
                 'error': f'Scraping error: {str(e)}'
             }
     
+    def scrape_future(self, url: str) -> Future:
+        """
+        Schedule scrape_url on the shared background event loop without
+        waiting for it. No thread is held while the page loads, so any
+        number of scrapes can be in flight at once.
+        
+        Args:
+            url: The target website URL to scrape
+            
+        Returns:
+            Future resolving to a dictionary with same structure as scrape_url()
+        """
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self.scrape_url(url), loop)
+    
     def scrape_sync(self, url: str) -> Dict[str, any]:
         """
         Synchronous wrapper for the async scrape_url method.
         This is useful for Flask routes that don't support async/await.
+        The scrape runs on the shared background event loop.
         
         Args:
             url: The target website URL to scrape
@@ -80,7 +229,41 @@ class WebScraper:
         Returns:
             Dictionary with same structure as scrape_url()
         """
-        return asyncio.run(self.scrape_url(url))
+        return self.scrape_future(url).result()
+    
+    async def scrape_urls(self, urls: List[str]) -> List[Dict[str, any]]:
+        """
+        Asynchronously scrape several websites concurrently.
+        
+        At most 8 pages are loaded at once. Must run on the scraper's
+        background event loop (see scrape_urls_sync()).
+        
+        Args:
+            urls: The target website URLs to scrape
+            
+        Returns:
+            List of dictionaries with the same structure as scrape_url(),
+            in the same order as urls
+        """
+        async def scrape_bounded(url: str) -> Dict[str, any]:
+            async with self._batch_semaphore:
+                return await self.scrape_url(url)
+        
+        return list(await asyncio.gather(*(scrape_bounded(url) for url in urls)))
+    
+    def scrape_urls_sync(self, urls: List[str]) -> List[Dict[str, any]]:
+        """
+        Synchronous wrapper for the async scrape_urls method.
+        The scrapes run on the shared background event loop.
+        
+        Args:
+            urls: The target website URLs to scrape
+            
+        Returns:
+            List of dictionaries with same structure as scrape_url()
+        """
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self.scrape_urls(urls), loop).result()
     
     def _is_valid_url(self, url: str) -> bool:
         """
@@ -95,13 +278,27 @@ class WebScraper:
         if not url or not isinstance(url, str):
             return False
         
-        # Basic URL pattern validation
-        url_pattern = re.compile(
-            r'^https?://'  # http:// or https://
-            r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'  # domain...
-            r'localhost|'  # localhost...
-            r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
-            r'(?::\d+)?'  # optional port
-            r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+        # ASCII URLs (the common case) are checked with str's built-in
+        # character tables; ASCII whitespace other than the space is
+        # non-printable. Anything else falls back to the regex.
+        if url.isascii():
+            if ' ' in url or not url.isprintable():
+                return False
+        elif _WHITESPACE_RE.search(url):
+            return False
+        
+        # Parse with urllib.parse rather than a backtracking regex: linear
+        # time and no ReDoS exposure on long or malicious URLs
+        try:
+            parts = urlsplit(url)
+            parts.port  # raises ValueError for a malformed port
+        except ValueError:
+            return False
         
-        return bool(url_pattern.match(url))
+        # Host must be localhost or dotted (a domain name or an IPv4 address)
+        host = parts.hostname
+        return (
+            parts.scheme in ('http', 'https')
+            and bool(host)
+            and (host == 'localhost' or '.' in host)
+        )
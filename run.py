@@ -1,7 +1,8 @@
 """
 Flask Application Entry Point
 
-This script starts the Flask development server.
+This script starts the Flask development server when FLASK_ENV=development.
+In any other environment it prints how to start a production server instead.
 
 Usage:
     python run.py
@@ -11,13 +12,47 @@ Environment Variables:
     - OPENAI_API_KEY: OpenAI API key for AI processing
     - DATABASE_PATH: Path to SQLite database file (default: database.db)
     - FLASK_ENV: Flask environment (development/production)
+
+Deployment:
+    In production, run the WSGI app under Gunicorn with threaded workers, so
+    slow chat requests and open /message/stream responses each hold a thread
+    rather than a whole worker:
+
+        gunicorn -k gthread -w $(nproc) --threads 64 --preload -b 0.0.0.0:5000 'backend.app:create_app()'
+
+    --preload imports the code and runs create_app() once in the master
+    process, and forked workers share those pages copy-on-write. Anything
+    that holds OS resources is still per worker: the OpenAI connection pool
+    is opened (and warmed up) in each worker after fork, and the scraper's
+    event loop and browser and the bcrypt process pool are only started on
+    first use inside each worker.
+
+    The ASGI wrapper (asgi.py) can instead be served by Uvicorn workers:
+
+        gunicorn -k uvicorn.workers.UvicornWorker -w $(nproc) -b 0.0.0.0:5000 asgi:app
 """
 
+import os
+import sys
+
+from dotenv import load_dotenv
+
 from backend.app import create_app
 
+PRODUCTION_COMMAND = (
+    "gunicorn -k gthread -w $(nproc) --threads 64 --preload "
+    "-b 0.0.0.0:5000 'backend.app:create_app()'"
+)
+
 if __name__ == '__main__':
+    load_dotenv()
+
+    if os.getenv('FLASK_ENV') != 'development':
+        print("The Flask development server only runs with FLASK_ENV=development.")
+        print(f"For production, run:\n    {PRODUCTION_COMMAND}")
+        sys.exit(1)
+
     app = create_app()
-    
+
     # Run the Flask development server
-    # Note: For production, use a WSGI server like Gunicorn
     app.run(debug=True, host='0.0.0.0', port=5000)